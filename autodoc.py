@@ -1,6 +1,4 @@
 #!/usr/bin/env python3
-from search import makeGroupsOfPoints, greedyPathThroughPts
-
 class NavFilePoint:
 
     def __init__(self, label: str, regis: int, ptsX: int, ptsY: int,
@@ -69,6 +67,8 @@ def sectionAsDict(data: 'list', label: str):
 
 def coordsToNavPoints(coords, mapSection: 'Dict', startLabel: int, acquire,
                       groupOpt: int, groupRadiusPix):
+    # search pulls in numpy, cv2 and scipy; only load them when writing points
+    from search import makeGroupsOfPoints, greedyPathThroughPts
     regis = int(mapSection['Regis'][0])
     drawnID = int(mapSection['MapID'][0])
     zHeight = float(mapSection['StageXYZ'][2])
@@ -83,7 +83,8 @@ def coordsToNavPoints(coords, mapSection: 'Dict', startLabel: int, acquire,
     elif groupOpt == 1: # groups withing mesh
         for group in makeGroupsOfPoints(coords, groupRadiusPix):
             subLabel = 1
-            groupID = id(group)
+            # labels are unique for the session, unlike id() of a freed list
+            groupID = label
             for pt in group:
                 navPoints.append(NavFilePoint(f"{label}-{subLabel}", regis,
                                              *pt, zHeight, drawnID,
@@ -101,3 +102,10 @@ def coordsToNavPoints(coords, mapSection: 'Dict', startLabel: int, acquire,
     numGroups = label - startLabel
     return navPoints, numGroups
 
+def writeNavFile(filename, navPoints, append=False):
+    """Writes nav points to a new autodoc, or appends them to an existing one"""
+    with open(filename, 'a' if append else 'w') as f:
+        if not append:
+            f.write('AdocVersion = 2.00\n\n')
+        for navPoint in navPoints:
+            f.write(navPoint.toString())
@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+import os
+import json
+import hashlib
+import tempfile
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser('~'),
+                                 '.find_grid_holes_cache')
+
+def hashArray(arr: 'ndarray'):
+    h = hashlib.sha256(f"{arr.shape}{arr.dtype}".encode())
+    h.update(arr.data if arr.flags.c_contiguous else arr.tobytes())
+    return h.hexdigest()
+
+
+class SearchCache:
+    """On-disk cache of templateMatch results. Entries are keyed by hashes of
+    the image and template pixels plus the search parameters, so a blurred
+    image or template gets its own entry. Least recently used entries are
+    removed once the directory grows past maxBytes. Raises OSError if the
+    directory cannot be created.
+    """
+
+    def __init__(self, directory=DEFAULT_CACHE_DIR, maxBytes=50 * 2**20):
+        self.directory = directory
+        self.maxBytes = maxBytes
+        os.makedirs(directory, exist_ok=True)
+
+    def key(self, imgHash: str, templateHash: str, threshold, downSample):
+        """Combines hashes of the image and template pixels, e.g. from
+        hashArray, with the search parameters"""
+        h = hashlib.sha256()
+        h.update(imgHash.encode())
+        h.update(templateHash.encode())
+        h.update(f"{threshold!r},{downSample!r}".encode())
+        return h.hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + '.json')
+
+    def get(self, key):
+        """Returns (matches, scores) or None"""
+        path = self._path(key)
+        try:
+            with open(path) as f:
+                entries = json.load(f)
+            matches = [(x, y) for x, y, _ in entries]
+            scores = [score for _, _, score in entries]
+            os.utime(path) # mark as recently used
+        except (OSError, ValueError, TypeError):
+            return None
+        return matches, scores
+
+    def put(self, key, matches, scores):
+        # unique temp name, other processes may share the cache directory
+        try:
+            fd, tmp = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        except OSError:
+            return
+        try:
+            with os.fdopen(fd, 'w') as f:
+                json.dump([[int(x), int(y), float(score)] for (x, y), score
+                           in zip(matches, scores)], f)
+            os.replace(tmp, self._path(key))
+        except OSError:
+            try:
+                os.remove(tmp)
+            except OSError:
+                pass
+            return
+        self._evict()
+
+    def _evict(self):
+        entries = []
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith('.json'):
+                try:
+                    stat = entry.stat()
+                except OSError: # evicted by another process
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+        totalBytes = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if totalBytes <= self.maxBytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            totalBytes -= size
@@ -0,0 +1,58 @@
+#!/usr/bin/env python3
+"""Launches Find Grid Holes with --startup-time and fails if the main window
+takes longer than the limit to appear. Run it on the PyInstaller build after
+building, e.g.
+
+    python check_startup.py dist/gui/gui --limit 2
+
+The time is measured from process launch, so it includes the bootloader and
+interpreter startup. The first run after building is the cold start; the
+slowest run is checked against the limit.
+"""
+import sys
+import time
+import argparse
+import subprocess
+
+
+def timeToWindow(command):
+    """Returns wall-clock seconds from launching command until it reports
+    the main window shown"""
+    start = time.perf_counter()
+    proc = subprocess.Popen(command + ['--startup-time'],
+                            stdout=subprocess.PIPE, universal_newlines=True)
+    elapsed = None
+    for line in proc.stdout:
+        print(line.rstrip())
+        if elapsed is None and line.startswith('startup time:'):
+            elapsed = time.perf_counter() - start
+    proc.wait()
+    if proc.returncode != 0:
+        sys.exit(f"exited with status {proc.returncode}")
+    if elapsed is None:
+        sys.exit("no startup time reported")
+    return elapsed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('command', nargs='*',
+                        default=[sys.executable, 'gui.py'],
+                        help="program to launch, defaults to python gui.py")
+    parser.add_argument('--limit', type=float, default=2.0,
+                        help="maximum seconds until the window is shown")
+    parser.add_argument('--runs', type=int, default=3)
+    args = parser.parse_args(argv)
+
+    times = []
+    for run in range(args.runs):
+        times.append(timeToWindow(args.command))
+        print(f"run {run + 1}: window shown after {times[-1]:.3f} s")
+
+    print(f"first run: {times[0]:.3f} s, slowest run: {max(times):.3f} s")
+    if max(times) > args.limit:
+        sys.exit(f"startup time exceeds limit of {args.limit} s")
+
+
+if __name__ == '__main__':
+    main()
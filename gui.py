@@ -1,47 +1,77 @@
 #!/usr/bin/env python3
+# record launch time before any other import so --startup-time includes them
+import time
+startTime = time.perf_counter()
 import io
+import hashlib
 import sys
-import cv2
-import numpy as np
-from PIL import Image, ImageFilter
-from PIL.ImageQt import ImageQt
-from PyQt5.QtCore import Qt, QRect, QSize, QBuffer
+import threading
+from PyQt5.QtCore import Qt, QRect, QSize, QBuffer, QTimer
 from PyQt5.QtWidgets import (QApplication, QWidget, QMainWindow, QAction,
                              QHBoxLayout, QVBoxLayout, QGridLayout, QLabel,
                              QScrollArea, QPushButton, QFileDialog, QCheckBox,
                              QSlider, QLineEdit, QRubberBand, QMessageBox,
                              QInputDialog, QDoubleSpinBox, QComboBox)
 from PyQt5.QtGui import QImage, QPixmap, QKeySequence, QPainter, QBrush, QColor
-from search import templateMatch
 from autodoc import (isValidAutodoc, isValidLabel, sectionAsDict,
-                     coordsToNavPoints)
-
-# Unset PIL max size
-Image.MAX_IMAGE_PIXELS = None
+                     coordsToNavPoints, writeNavFile)
+from cache import SearchCache
+
+# cv2, numpy, PIL and scipy (through search) are imported on first use so the
+# main window appears before they finish loading
+def pilImage():
+    from PIL import Image
+    # Unset PIL max size
+    Image.MAX_IMAGE_PIXELS = None
+    return Image
+
+def preloadModules():
+    """Imports the scientific libraries ahead of their first use. Meant to run
+    in a background thread once the main window is shown."""
+    pilImage()
+    import PIL.ImageFilter
+    import PIL.ImageQt
+    import scipy.misc
+    import search
 
 # image data manipulation
 def npToQImage(ndArr):
-    return QPixmap.fromImage(ImageQt(Image.fromarray(ndArr))).toImage()
+    from PIL.ImageQt import ImageQt
+    return QPixmap.fromImage(ImageQt(pilImage().fromarray(ndArr))).toImage()
 
 def qImgToPilRGBA(qimg):
     buf = QBuffer()
     buf.open(QBuffer.ReadWrite)
     qimg.save(buf, "PNG")
-    return Image.open(io.BytesIO(buf.data().data())).convert('RGBA')
+    return pilImage().open(io.BytesIO(buf.data().data())).convert('RGBA')
 
 def qImgToNp(qimg):
+    import numpy as np
     return np.array(qImgToPilRGBA(qimg))
 
+def hashQImage(qimg):
+    """Hashes the QImage pixels directly, skipping the conversion to ndarray"""
+    h = hashlib.sha256(f"{qimg.format()},{qimg.width()},{qimg.height()},"
+                       f"{qimg.bytesPerLine()}".encode())
+    bits = qimg.constBits()
+    bits.setsize(qimg.sizeInBytes())
+    h.update(bits.asstring())
+    return h.hexdigest()
+
 def gaussianBlur(qimg, radius=5):
+    from PIL import ImageFilter
+    from PIL.ImageQt import ImageQt
     pilImg = qImgToPilRGBA(qimg).filter(ImageFilter.GaussianBlur(radius))
     return QPixmap.fromImage(ImageQt(pilImg)).toImage()
 
 def drawCross(img: 'ndarray', x, y):
+    import cv2
     red = (255,0,0,255)
     cv2.line(img, (x-15,y), (x+15,y), red, 3)
     cv2.line(img, (x,y-15), (x,y+15), red, 3)
 
 def drawCrosses(img: 'ndarray', coords):
+    import numpy as np
     img = np.flip(img, 0).copy()
     for x, y in coords:
         drawCross(img, x, y)
@@ -212,6 +242,14 @@ class Sidebar(QWidget):
         self.lastStartLabel = 0
         self.generatedNav = ''
         self.coords = []
+        self.scores = []
+        self.holeStats = None
+        self.templSize = (0, 0)
+        try:
+            self.searchCache = SearchCache()
+        except OSError as e:
+            print(f"search cache disabled: {e}")
+            self.searchCache = None
 
         # widgets
         self.crop_template = ImageViewer()
@@ -263,6 +301,11 @@ class Sidebar(QWidget):
                  lambda: self._setPixelSize(self.pixelSizeLineEdit.text()))
         self._setPixelSize(str(self.pixelSizeNm))
         self.pixelSizeLabelnm = QLabel('nm')
+        # hole filter limits are read when searching
+        self.minMeanLineEdit = QLineEdit()
+        self.maxMeanLineEdit = QLineEdit()
+        self.maxVarLineEdit = QLineEdit()
+        self.maxHolesLineEdit = QLineEdit()
 
         # layout
         vlay = QVBoxLayout()
@@ -276,6 +319,17 @@ class Sidebar(QWidget):
         vlay.addWidget(buttonSearch)
         vlay.addWidget(buttonPrintCoord)
         vlay.addWidget(buttonClearPts)
+        vlay.addWidget(QLabel('Hole filter (blank for no limit)'))
+        holeFilterLay = QGridLayout()
+        holeFilterLay.addWidget(QLabel('Min mean'), 0, 0)
+        holeFilterLay.addWidget(self.minMeanLineEdit, 0, 1)
+        holeFilterLay.addWidget(QLabel('Max mean'), 1, 0)
+        holeFilterLay.addWidget(self.maxMeanLineEdit, 1, 1)
+        holeFilterLay.addWidget(QLabel('Max variance'), 2, 0)
+        holeFilterLay.addWidget(self.maxVarLineEdit, 2, 1)
+        holeFilterLay.addWidget(QLabel('Max holes'), 3, 0)
+        holeFilterLay.addWidget(self.maxHolesLineEdit, 3, 1)
+        vlay.addLayout(holeFilterLay)
         vlay.addWidget(QLabel())
         vlay.addWidget(buttonNewNavFile)
         vlay.addWidget(buttonAppendNav)
@@ -319,22 +373,86 @@ class Sidebar(QWidget):
         if img.isNull() or templ.isNull():
             popup(self, "either image or template missing")
             return
+        try:
+            holeLimits = self._holeLimits()
+            maxHoles = self._maxHoles()
+        except ValueError:
+            popup(self, "hole filter limits must be numbers")
+            return
 
-        self.coords = templateMatch(qImgToNp(img), qImgToNp(templ),
-                                self.thresholdVal)
+        from search import templateMatch, pruneHoles
+        # look up the cache before converting, which is most of a search
+        downSample = 4
+        result = None
+        imgArr = None
+        if self.searchCache is not None:
+            key = self.searchCache.key(hashQImage(img), hashQImage(templ),
+                                       self.thresholdVal, downSample)
+            result = self.searchCache.get(key)
+        if result is None:
+            imgArr = qImgToNp(img)
+            result = templateMatch(imgArr, qImgToNp(templ), self.thresholdVal,
+                                   downSample, withScores=True)
+            if self.searchCache is not None:
+                self.searchCache.put(key, *result)
+        self.coords, self.scores = result
+        self.holeStats = None
+        self.templSize = (templ.height(), templ.width())
+        if holeLimits or maxHoles is not None:
+            # reuse the searched array if it is the unblurred image
+            stats = self._holeStatistics(None if self.cbBlurImg.isChecked()
+                                         else imgArr)
+            keep = pruneHoles(stats, holeLimits, rankBy='score',
+                              maxHoles=maxHoles)
+            self.coords = [self.coords[i] for i in keep]
+            self.scores = [self.scores[i] for i in keep]
+            self.holeStats = {name: vals[keep] for name, vals in stats.items()}
         viewer = self.parentWidget().viewer
         viewer.searchedImg = drawCoords(viewer.originalImg, self.coords)
         viewer.searchedBlurImg = drawCoords(viewer.blurredImg, self.coords)
         viewer._setActiveImg(viewer.searchedBlurImg
                              if self.cbBlurImg.isChecked()
                              else viewer.searchedImg)
+        self._showHoleSummary()
         self.repaint()
 
+    def _holeStatistics(self, imgArr=None):
+        """Returns statistics of the current holes, measured on the unblurred
+        image so limits don't depend on the blur checkboxes. imgArr is the
+        unblurred image as an ndarray if it has already been converted.
+        """
+        if self.holeStats is None:
+            from search import holeStatistics
+            if imgArr is None:
+                imgArr = qImgToNp(self.parentWidget().viewer.originalImg)
+            self.holeStats = holeStatistics(imgArr, self.templSize,
+                                            self.coords, self.scores)
+        return self.holeStats
+
+    def _showHoleSummary(self):
+        message = f"{len(self.coords)} holes"
+        if self.coords:
+            message += f"; score {min(self.scores):.3f}-{max(self.scores):.3f}"
+        if self.holeStats is not None and self.coords:
+            for name in ('mean', 'var'):
+                vals = self.holeStats[name]
+                message += f"; {name} {vals.min():.1f}-{vals.max():.1f}"
+        self.parentWidget().parentWidget().statusBar().showMessage(message)
+
     def printCoordinates(self):
-        popup(self, f"{len(self.coords)} points: {str(self.coords)}")
+        if not self.coords:
+            popup(self, "0 points")
+            return
+        stats = self._holeStatistics()
+        lines = [f"{pt}: score {score:.3f}, mean {mean:.1f}, var {var:.1f}"
+                 for pt, score, mean, var in zip(self.coords, stats['score'],
+                                                 stats['mean'], stats['var'])]
+        popup(self, f"{len(self.coords)} points:\n" + '\n'.join(lines))
 
     def _clearPts(self):
         self.coords = []
+        self.scores = []
+        self.holeStats = None
         self.cbBlurImg.setCheckState(Qt.Unchecked)
         viewer = self.parentWidget().viewer
         viewer._setActiveImg(viewer.originalImg)
@@ -386,16 +504,11 @@ class Sidebar(QWidget):
                                                  groupRadiusPixels)
 
         if isNew:
-            with open(filename, 'w') as f:
-                f.write('AdocVersion = 2.00\n\n')
-                for navPoint in navPoints:
-                    f.write(navPoint.toString())
+            writeNavFile(filename, navPoints)
             popup(self, "nav file created")
             self.generatedNav = filename
         else:
-            with open(self.generatedNav, 'a') as f:
-                for navPoint in navPoints:
-                    f.write(navPoint.toString())
+            writeNavFile(self.generatedNav, navPoints, append=True)
             popup(self, "points added to nav file")
         # update fields
         self.lastGroupSize = numGroups
@@ -416,6 +529,28 @@ class Sidebar(QWidget):
         except:
             pass
 
+    def _holeLimits(self):
+        """Returns the hole filter limits typed in the sidebar, leaving out
+        statistics without limits. Raises ValueError on non-numeric text.
+        """
+        def limit(lineEdit):
+            s = lineEdit.text().strip()
+            return float(s) if s else None
+        limits = {'mean': (limit(self.minMeanLineEdit),
+                           limit(self.maxMeanLineEdit)),
+                  'var': (None, limit(self.maxVarLineEdit))}
+        return {stat: pair for stat, pair in limits.items()
+                if pair != (None, None)}
+
+    def _maxHoles(self):
+        """Returns how many of the best scoring holes to keep, or None"""
+        s = self.maxHolesLineEdit.text().strip()
+        if not s:
+            return None
+        if int(s) < 0:
+            raise ValueError("negative hole count")
+        return int(s)
+
     def _selectGroupOption(self, i):
         if i == 1: # groups within mesh
             self.groupRadiusLabel.show()
@@ -517,7 +652,29 @@ class MainWindow(QMainWindow):
 
 
 if __name__ == '__main__':
+    # --startup-time prints seconds from launch until the main window is shown
+    # and until the background preload finishes, then exits
     app = QApplication(sys.argv)
     w = MainWindow()
+    preload = threading.Thread(target=preloadModules, daemon=True)
+
+    def reportPreloadTime():
+        if preload.is_alive():
+            QTimer.singleShot(10, reportPreloadTime)
+            return
+        print(f"preload time: {time.perf_counter() - startTime:.3f} s",
+              flush=True)
+        app.quit()
+
+    def startPreload():
+        if '--startup-time' in sys.argv:
+            print(f"startup time: {time.perf_counter() - startTime:.3f} s",
+                  flush=True)
+        preload.start()
+        if '--startup-time' in sys.argv:
+            reportPreloadTime()
+
+    # runs once the event loop has shown the window
+    QTimer.singleShot(0, startPreload)
     sys.exit(app.exec_())
 
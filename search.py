@@ -1,7 +1,7 @@
 #!/usr/bin/env python3
 import numpy as np
 import cv2
-from scipy.misc import imresize
+from cache import hashArray
 
 
 # for relative distance, square distance is faster to compute
@@ -21,14 +21,27 @@ def pointsExistWithinRadius(center, coords, radius):
 # modified from OpenCV docs
 # https://docs.opencv.org/3.4/d4/dc6/tutorial_py_template_matching.html
 def templateMatch(img: 'ndarray', template: 'ndarray', threshold=0.8,
-                  downSample=4):
+                  downSample=4, cache=None, withScores=False):
     """Returns coordinate list of positions with the highest cross-correlation
     to the template array and also returns the same input array with blue
     crosses at each coordinate. Images are internally downsampled for faster
     computation and noise reduction.
 
     0,0 is at the bottom-left corner, with +y going up and +x going right.
+
+    If withScores is True, also returns the cross-correlation score of each
+    coordinate, on the same scale as threshold. If a SearchCache is given,
+    results of a previous search with the same image, template and parameters
+    are returned from it.
     """
+    if cache is not None:
+        key = cache.key(hashArray(img), hashArray(template), threshold,
+                        downSample)
+        cached = cache.get(key)
+        if cached is not None:
+            return cached if withScores else cached[0]
+    # scipy is slow to import and only needed here
+    from scipy.misc import imresize
 
     img = np.stack((imresize(img[:,:,i], 1/downSample)
                     for i in range(4)), axis=2)
@@ -44,14 +57,65 @@ def templateMatch(img: 'ndarray', template: 'ndarray', threshold=0.8,
     scoresIndex.sort(key=lambda a: a[2], reverse=True)
 
     matches = []
-    for x, y, _ in scoresIndex:
+    scores = []
+    for x, y, score in scoresIndex:
         x += w//2
         y += h//2
         if not pointsExistWithinRadius((x,y), matches, radius=max(h,w)):
             matches.append((x,y))
+            scores.append(float(score))
     # multiply back to get correct coordinates
-    matches = [(downSample*x, downSample*y) for x,y in matches]
-    return matches
+    matches = [(int(downSample*x), int(downSample*y)) for x,y in matches]
+    if cache is not None:
+        cache.put(key, matches, scores)
+    return (matches, scores) if withScores else matches
+
+def holeStatistics(img: 'ndarray', templateShape, coords, scores,
+                   downSample=4):
+    """Returns a dict of arrays with the grayscale 'mean' and 'var' of a
+    template-sized patch centered on each coordinate, along with the
+    templateMatch 'score' of each coordinate. All patches are gathered with
+    one fancy-indexing pass, sampling every downSample-th pixel, and only the
+    patches are converted to gray.
+
+    Coordinates use the same bottom-left origin as templateMatch.
+    """
+    if len(coords) == 0:
+        empty = np.empty(0)
+        return {'mean': empty, 'var': empty, 'score': empty}
+    h, w = templateShape[:2]
+    xs, ys = np.array(coords).T
+    rows = (ys - h//2)[:, None] + np.arange(0, h, downSample)[None, :]
+    cols = (xs - w//2)[:, None] + np.arange(0, w, downSample)[None, :]
+    # clamp patches that extend past the image border
+    rows = np.clip(rows, 0, img.shape[0] - 1)
+    cols = np.clip(cols, 0, img.shape[1] - 1)
+    # index the unflipped image with flipped row numbers
+    rows = img.shape[0] - 1 - rows
+    patches = img[rows[:, :, None], cols[:, None, :], :3].mean(
+                  axis=3, dtype=np.float32)
+    return {'mean': patches.mean(axis=(1, 2)),
+            'var': patches.var(axis=(1, 2)),
+            'score': np.asarray(scores, dtype=np.float32)}
+
+def pruneHoles(stats: 'Dict', limits: 'Dict', rankBy=None, maxHoles=None):
+    """Returns indices of the holes whose statistics fall within limits, which
+    maps a statistic name to a (min, max) pair; either bound may be None. If
+    rankBy names a statistic, holes are sorted by it in descending order, and
+    at most maxHoles are kept.
+    """
+    keep = np.ones(len(stats['score']), dtype=bool)
+    for name, (low, high) in limits.items():
+        if low is not None:
+            keep &= stats[name] >= low
+        if high is not None:
+            keep &= stats[name] <= high
+    indices = np.flatnonzero(keep)
+    if rankBy is not None:
+        indices = indices[np.argsort(-stats[rankBy][indices], kind='stable')]
+    if maxHoles is not None:
+        indices = indices[:maxHoles]
+    return indices
 
 def centroid(pts: 'ndarray'):
     length = pts.shape[0]
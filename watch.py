@@ -0,0 +1,243 @@
+#!/usr/bin/env python3
+import os
+import sys
+import time
+import argparse
+import numpy as np
+from PIL import Image, ImageFilter
+from search import templateMatch, holeStatistics, pruneHoles
+from cache import SearchCache, DEFAULT_CACHE_DIR
+from autodoc import (isValidAutodoc, isValidLabel, sectionAsDict,
+                     coordsToNavPoints, writeNavFile)
+
+# Unset PIL max size
+Image.MAX_IMAGE_PIXELS = None
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.tif', '.tiff')
+
+def loadRGBA(filename):
+    """Reads an image as an RGBA array, the same layout the GUI searches on"""
+    return np.array(Image.open(filename).convert('RGBA'))
+
+def blurRGBA(img: 'ndarray'):
+    return np.array(Image.fromarray(img).filter(ImageFilter.GaussianBlur(5)))
+
+def readNavFile(navfile):
+    with open(navfile) as f:
+        return [line.strip() for line in f.readlines()]
+
+
+class FolderWatcher:
+    """Polls a directory for new MMM exports, searches each one for holes
+    and appends the points to a generated nav file. The template and nav file
+    stay loaded between images; the nav file is only re-read when SerialEM
+    changes it.
+    """
+
+    def __init__(self, folder, template, navfile, output, startLabel,
+                 mapLabel=None, threshold=0.8, blurImg=False,
+                 blurTemplate=False, acquire=1,
+                 groupOpt=2, groupRadiusPix=700, includeExisting=False,
+                 cache=None, holeLimits=None, maxHoles=None):
+        self.folder = folder
+        # the template's size sets the patch size for hole statistics
+        self.template = template
+        self.searchTemplate = blurRGBA(template) if blurTemplate else template
+        self.navfile = navfile
+        self.navfileLines = []
+        self.navfileMtime = None
+        self.output = output
+        self.mapLabel = mapLabel
+        self.threshold = threshold
+        self.blurImg = blurImg
+        self.acquire = acquire
+        self.groupOpt = groupOpt
+        self.groupRadiusPix = groupRadiusPix
+        self.cache = cache
+        self.holeLimits = holeLimits or {}
+        self.maxHoles = maxHoles
+        # label continuation, as lastStartLabel + lastGroupSize in the GUI
+        self.nextLabel = startLabel
+        self.pendingSizes = {}
+        # images that could not be processed yet, with the image size and nav
+        # file mtime at the last attempt; retried once either changes
+        self.waiting = {}
+        self.seen = set() if includeExisting else set(self._imageFiles())
+
+    def _imageFiles(self):
+        return sorted(entry.path for entry in os.scandir(self.folder)
+                      if entry.is_file()
+                      and entry.name.lower().endswith(IMAGE_EXTENSIONS))
+
+    def _reloadNavFile(self):
+        mtime = os.path.getmtime(self.navfile)
+        if mtime != self.navfileMtime:
+            self.navfileLines = readNavFile(self.navfile)
+            self.navfileMtime = mtime
+
+    def newImages(self):
+        """Returns images that appeared since the last poll and whose size
+        has stopped changing, i.e. SerialEM has finished writing them.
+        """
+        ready = []
+        navfileMtime = os.path.getmtime(self.navfile)
+        for path in self._imageFiles():
+            if path in self.seen:
+                continue
+            try:
+                size = os.path.getsize(path)
+            except OSError: # removed since the scan
+                continue
+            if path in self.waiting:
+                if self.waiting[path] == (size, navfileMtime):
+                    continue
+                del self.waiting[path]
+            if size > 0 and self.pendingSizes.get(path) == size:
+                del self.pendingSizes[path]
+                ready.append(path)
+            else:
+                self.pendingSizes[path] = size
+        return ready
+
+    def processImage(self, path):
+        """Searches one image and appends its points to the output nav file.
+        Returns False if the image should be retried later.
+        """
+        self._reloadNavFile()
+        mapLabel = self.mapLabel or os.path.splitext(os.path.basename(path))[0]
+        if not isValidLabel(self.navfileLines, mapLabel):
+            print(f"waiting on {path}: map label {mapLabel} not in nav file")
+            return False
+        try:
+            img = loadRGBA(path)
+        except OSError:
+            print(f"waiting on {path}: could not load image")
+            return False
+
+        searchImg = blurRGBA(img) if self.blurImg else img
+        coords, scores = templateMatch(searchImg, self.searchTemplate,
+                                       self.threshold, cache=self.cache,
+                                       withScores=True)
+        if self.holeLimits or self.maxHoles is not None:
+            numMatched = len(coords)
+            stats = holeStatistics(img, self.template.shape, coords, scores)
+            keep = pruneHoles(stats, self.holeLimits, rankBy='score',
+                              maxHoles=self.maxHoles)
+            coords = [coords[i] for i in keep]
+            print(f"{path}: kept {len(coords)} of {numMatched} holes")
+        if not coords:
+            print(f"{path}: no holes found")
+            return True
+        mapSection = sectionAsDict(self.navfileLines, mapLabel)
+        navPoints, numGroups = coordsToNavPoints(coords, mapSection,
+                                                 self.nextLabel, self.acquire,
+                                                 self.groupOpt,
+                                                 self.groupRadiusPix)
+        writeNavFile(self.output, navPoints,
+                     append=os.path.exists(self.output))
+        print(f"{path}: {len(coords)} points added to {self.output} "
+              f"as labels {self.nextLabel}-{self.nextLabel + numGroups - 1}")
+        self.nextLabel += numGroups
+        return True
+
+    def run(self, pollInterval=1.0):
+        print(f"watching {self.folder}")
+        while True:
+            try:
+                paths = self.newImages()
+            except OSError as e:
+                print(f"could not scan {self.folder}: {e}")
+                paths = []
+            for path in paths:
+                # one bad export must not end the session
+                try:
+                    done = self.processImage(path)
+                except Exception as e:
+                    print(f"error processing {path}: {e!r}")
+                    done = False
+                if done:
+                    self.seen.add(path)
+                else:
+                    try:
+                        self.waiting[path] = (os.path.getsize(path),
+                                              os.path.getmtime(self.navfile))
+                    except OSError:
+                        pass
+            time.sleep(pollInterval)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Search new montage images in a folder as SerialEM "
+                    "exports them and append the holes to a nav file.")
+    parser.add_argument('folder', help="directory SerialEM saves maps into")
+    parser.add_argument('--template', required=True,
+                        help="image of a single cropped hole")
+    parser.add_argument('--navfile', required=True,
+                        help="session nav file containing the maps")
+    parser.add_argument('--output', required=True,
+                        help="nav file to create or append new points to")
+    parser.add_argument('--start-label', type=int, required=True,
+                        help="label number of the first new item")
+    parser.add_argument('--map-label',
+                        help="label of the map to merge onto; defaults to "
+                             "each image's file name without extension")
+    parser.add_argument('--threshold', type=float, default=0.8)
+    parser.add_argument('--blur-image', action='store_true')
+    parser.add_argument('--blur-template', action='store_true')
+    parser.add_argument('--no-acquire', action='store_true')
+    parser.add_argument('--group', type=int, choices=(0, 1, 2), default=2,
+                        help="0: no groups, 1: groups within mesh, "
+                             "2: entire mesh as one group")
+    parser.add_argument('--group-radius', type=float, default=7,
+                        help="µm, used with --group 1")
+    parser.add_argument('--pixel-size', type=float, default=10,
+                        help="nm, used with --group 1")
+    parser.add_argument('--poll-interval', type=float, default=1.0,
+                        help="seconds between directory scans")
+    parser.add_argument('--include-existing', action='store_true',
+                        help="also process images already in the folder")
+    parser.add_argument('--min-mean', type=float,
+                        help="drop holes with a darker mean intensity")
+    parser.add_argument('--max-mean', type=float,
+                        help="drop holes with a brighter mean intensity")
+    parser.add_argument('--max-var', type=float,
+                        help="drop holes with a higher intensity variance")
+    parser.add_argument('--max-holes', type=int,
+                        help="keep at most this many holes with the best "
+                             "template match score")
+    parser.add_argument('--cache-dir', default=DEFAULT_CACHE_DIR,
+                        help="where search results are cached")
+    parser.add_argument('--no-cache', action='store_true')
+    args = parser.parse_args(argv)
+
+    if not isValidAutodoc(args.navfile):
+        sys.exit("could not read in nav file")
+    holeLimits = {}
+    if args.min_mean is not None or args.max_mean is not None:
+        holeLimits['mean'] = (args.min_mean, args.max_mean)
+    if args.max_var is not None:
+        holeLimits['var'] = (None, args.max_var)
+    watcher = FolderWatcher(args.folder,
+                            loadRGBA(args.template),
+                            args.navfile, args.output, args.start_label,
+                            mapLabel=args.map_label,
+                            threshold=args.threshold,
+                            blurImg=args.blur_image,
+                            blurTemplate=args.blur_template,
+                            acquire=int(not args.no_acquire),
+                            groupOpt=args.group,
+                            groupRadiusPix=1000 * args.group_radius
+                                           / args.pixel_size,
+                            includeExisting=args.include_existing,
+                            cache=None if args.no_cache
+                                  else SearchCache(args.cache_dir),
+                            holeLimits=holeLimits, maxHoles=args.max_holes)
+    try:
+        watcher.run(args.poll_interval)
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()